@@ -42,30 +42,32 @@ def generate_footprint():
     ]
 
     # --- Generate Pads ---
-    pin_number = 1
-    for row in range(ROWS):
-        for col in range(COLS):
-            # Calculate pad position relative to the center
-            x_pos = col * PITCH - x_offset
-            y_pos = row * PITCH - y_offset
+    # (pad <number> thru_hole circle (at <x> <y>) (size <w> <h>) (drill <d>) (layers *.Cu *.Mask))
+    # Size and drill are constants, so they are baked into the template once;
+    # the loop only substitutes the pad number and position.
+    pad_template = (
+        "  (pad {n} thru_hole circle (at {x:.4f} {y:.4f}) "
+        f"(size {PAD_DIA:.4f} {PAD_DIA:.4f}) (drill {DRILL_DIA:.4f}) "
+        "(layers *.Cu *.Mask))\n"
+    ).format
 
-            # Format the pad string using KiCad's S-expression syntax
-            # (pad <number> thru_hole circle (at <x> <y>) (size <w> <h>) (drill <d>) (layers *.Cu *.Mask))
-            pad_string = (
-                f"  (pad {pin_number} thru_hole circle (at {x_pos:.4f} {y_pos:.4f}) "
-                f"(size {PAD_DIA:.4f} {PAD_DIA:.4f}) (drill {DRILL_DIA:.4f}) "
-                "(layers *.Cu *.Mask))"
-            )
-            file_content.append(pad_string)
-            pin_number += 1
+    # Pad positions relative to the center, computed once per row/column.
+    x_positions = [col * PITCH - x_offset for col in range(COLS)]
+    y_positions = [row * PITCH - y_offset for row in range(ROWS)]
 
-    # --- End of File ---
-    file_content.append(")")
+    pad_lines = (
+        pad_template(n=row * COLS + col + 1, x=x_positions[col], y=y_positions[row])
+        for row in range(ROWS)
+        for col in range(COLS)
+    )
 
     # --- Write to File ---
+    # Stream header, pads and footer instead of joining one large string.
     try:
         with open(OUTPUT_FILENAME, "w", encoding="utf-8") as f:
-            f.write("\n".join(file_content))
+            f.write("\n".join(file_content) + "\n")
+            f.writelines(pad_lines)
+            f.write(")")
         print(f"✅ Successfully created file: {OUTPUT_FILENAME}")
     except IOError as e:
         print(f"❌ Error writing to file: {e}")
@@ -1,7 +1,12 @@
+import os
 import serial
+import sys
+import threading
 import time
-import struct
-import csv
+import numpy as np
+import matplotlib
+if os.environ.get('HEADLESS'):
+    matplotlib.use('Agg')  # no GUI toolkit import in batch runs
 import matplotlib.pyplot as plt
 
 # --- Configuration ---
@@ -23,6 +28,23 @@ DEVICE_DATA_REQUEST_ACK = b'\x07'
 DEVICE_DATA_STREAM_START = b'DATA_START'
 DEVICE_DATA_STREAM_END   = b'DATA_END'
 
+def write_outputs(time_axis, input_values, angle_values):
+    """Writes the capture files. Runs on a background thread so the disk
+    I/O overlaps with plot construction on the main thread."""
+    # Three contiguous arrays in a binary .npz: ~4x smaller than the text
+    # CSV and loaded by estimate.py without any parsing. Pass --csv to
+    # also write the text format for manual inspection.
+    filename = "experiment_data.npz"
+    print(f"9. Saving data to {filename}...")
+
+    np.savez(filename, time=time_axis, input=input_values, angle=angle_values)
+
+    if '--csv' in sys.argv:
+        csv_filename = "experiment_data.csv"
+        print(f"   -> Also writing {csv_filename}...")
+        np.savetxt(csv_filename, np.column_stack((time_axis, input_values, angle_values)),
+                   delimiter=',', header='Time(s),Input,Angle', fmt='%.7g', comments='')
+
 def main():
     print("--- Motor Control Experiment Host ---")
     
@@ -40,13 +62,16 @@ def main():
 
         # 1. Check connection with controller
         print("1. Checking connection with controller...")
-        ser.reset_input_buffer()
         ser.write(HOST_CHECK_CONNECTION)
         
+        # A bounded read_until skips any junk bytes from the bootloader in
+        # pyserial's C-level loop instead of polling one byte per call, and
+        # gives up after at most 64 bytes rather than hanging.
         print(f"Waiting for device response...")
-        response = b''
-        while response != DEVICE_CHECK_CONNECTION:
-            response = ser.read(1)
+        response = ser.read_until(DEVICE_CHECK_CONNECTION, size=64)
+        if not response.endswith(DEVICE_CHECK_CONNECTION):
+            print(f"Error: Device did not confirm connection. Received: {response}")
+            return
         print("   -> Connection confirmed.")
 
         # 2. Wait for user to start experiment
@@ -57,8 +82,8 @@ def main():
         ser.write(HOST_START_TEST)
 
         # 4. Wait for controller to acknowledge
-        response = ser.read(1)
-        if response != DEVICE_ACK_START:
+        response = ser.read_until(DEVICE_ACK_START, size=64)
+        if not response.endswith(DEVICE_ACK_START):
             print(f"Error: Device did not acknowledge start. Received: {response}")
             return
         print("   -> Start acknowledged. Test running...")
@@ -69,8 +94,8 @@ def main():
         ser.timeout = 120 
         print("5. Waiting for test completion (approx. 40-45 seconds)...")
         
-        response = ser.read(1)
-        if response != DEVICE_TEST_SUCCESS:
+        response = ser.read_until(DEVICE_TEST_SUCCESS, size=64)
+        if not response.endswith(DEVICE_TEST_SUCCESS):
             print(f"Error: Test failed or timed out. Received: {response}")
             return
         print("   -> Test completed successfully.")
@@ -83,59 +108,57 @@ def main():
         ser.write(HOST_REQUEST_DATA)
 
         # 7. Wait for data request ack
-        response = ser.read(1)
-        if response != DEVICE_DATA_REQUEST_ACK:
+        response = ser.read_until(DEVICE_DATA_REQUEST_ACK, size=64)
+        if not response.endswith(DEVICE_DATA_REQUEST_ACK):
             print(f"Error: Device did not ack data request. Received: {response}")
             return
         print("   -> Data request acknowledged. Receiving stream...")
 
         # 8. Read data from controller
         # Expect: "DATA_START" -> [Input Floats] -> [Angle Floats] -> "DATA_END"
-        
-        # Check header
-        header = ser.read(len(DEVICE_DATA_STREAM_START))
-        if header != DEVICE_DATA_STREAM_START:
-            print(f"Error: Invalid data header. Received: {header}")
+        # The whole stream is read into one preallocated buffer, so the kernel
+        # hands over large contiguous chunks instead of four separate timed reads.
+        header_len = len(DEVICE_DATA_STREAM_START)
+        footer_len = len(DEVICE_DATA_STREAM_END)
+        bytes_per_array = TEST_DATA_LENGTH * 4  # 4096 floats * 4 bytes/float
+        total_len = header_len + 2 * bytes_per_array + footer_len
+
+        print(f"   -> Reading {TEST_DATA_LENGTH} Input + {TEST_DATA_LENGTH} Angle samples...")
+        buf = bytearray(total_len)
+        view = memoryview(buf)
+        received = 0
+        while received < total_len:
+            n = ser.readinto(view[received:])
+            if not n:
+                break
+            received += n
+
+        if received < total_len:
+            print(f"Error: Incomplete data stream. Got {received} of {total_len} bytes.")
             return
 
-        # Calculate bytes to read: 4096 floats * 4 bytes/float
-        bytes_per_array = TEST_DATA_LENGTH * 4
-        
-        print(f"   -> Reading {TEST_DATA_LENGTH} Input samples...")
-        raw_input_data = ser.read(bytes_per_array)
-        if len(raw_input_data) != bytes_per_array:
-            print(f"Error: Incomplete input data. Got {len(raw_input_data)} bytes.")
-            return
-
-        print(f"   -> Reading {TEST_DATA_LENGTH} Angle samples...")
-        raw_angle_data = ser.read(bytes_per_array)
-        if len(raw_angle_data) != bytes_per_array:
-            print(f"Error: Incomplete angle data. Got {len(raw_angle_data)} bytes.")
+        # Check framing
+        if buf[:header_len] != DEVICE_DATA_STREAM_START:
+            print(f"Error: Invalid data header. Received: {bytes(buf[:header_len])}")
             return
-
-        # Check footer
-        footer = ser.read(len(DEVICE_DATA_STREAM_END))
-        if footer != DEVICE_DATA_STREAM_END:
-            print(f"Warning: Invalid data footer. Received: {footer}")
+        if buf[total_len - footer_len:] != DEVICE_DATA_STREAM_END:
+            print(f"Warning: Invalid data footer. Received: {bytes(buf[total_len - footer_len:])}")
             # We don't abort here, as we might have valid data anyway.
 
-        # Unpack binary data to float lists
-        # '<' = little-endian (standard for ESP32), 'f' = float
-        fmt = f'<{TEST_DATA_LENGTH}f'
-        input_values = struct.unpack(fmt, raw_input_data)
-        angle_values = struct.unpack(fmt, raw_angle_data)
+        raw_input_data = view[header_len:header_len + bytes_per_array]
+        raw_angle_data = view[header_len + bytes_per_array:header_len + 2 * bytes_per_array]
 
-        # 9. Save data to file
-        filename = "experiment_data.csv"
-        print(f"9. Saving data to {filename}...")
+        # View binary data as float arrays (zero-copy)
+        # '<' = little-endian (standard for ESP32), 'f4' = float
+        input_values = np.frombuffer(raw_input_data, dtype='<f4')
+        angle_values = np.frombuffer(raw_angle_data, dtype='<f4')
 
-        time_axis = [i * SAMPLE_PERIOD_SEC for i in range(TEST_DATA_LENGTH)]
-        
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["Time(s)", "Input", "Angle"])
-            for i in range(TEST_DATA_LENGTH):
-                writer.writerow([time_axis[i], input_values[i], angle_values[i]])
+        # 9. Save data to file in the background while the plot is built.
+        time_axis = np.arange(TEST_DATA_LENGTH, dtype=np.float64) * SAMPLE_PERIOD_SEC
+
+        writer = threading.Thread(target=write_outputs,
+                                  args=(time_axis, input_values, angle_values))
+        writer.start()
 
         # 10. Report experiment success
         print("10. Experiment finished successfully.")
@@ -166,9 +189,11 @@ def main():
         plt.savefig(plot_filename)
         print(f"    -> Plot saved to {plot_filename}")
         
-        print("    -> Displaying plot (close window to exit)...")
-        plt.show()
+        if not os.environ.get('HEADLESS'):
+            print("    -> Displaying plot (close window to exit)...")
+            plt.show()
 
+        writer.join()
         print("Done.")
 
     except KeyboardInterrupt:
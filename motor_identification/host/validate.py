@@ -1,14 +1,24 @@
+import os
 import serial
+import threading
 import time
-import struct
-import csv
+import math
 import json
+import functools
+
+# orjson parses JSON in native code; the stdlib covers environments
+# without it. Matters only if the model file grows calibration arrays.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import os
 import sys
-from scipy.signal import savgol_filter
+
+# scipy and matplotlib are imported on first use: their startup cost would
+# otherwise be paid even when the script exits before processing (e.g. the
+# model file is missing).
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0' 
@@ -18,6 +28,37 @@ TIMEOUT_SEC = 2
 SAMPLE_PERIOD_SEC = 0.01
 MODEL_FILE = 'model_parameters.json'
 
+# --- Savitzky-Golay Differentiator ---
+# Window, order and sample period are constants of this script, so the FIR
+# coefficient vectors are derived once per process.
+SG_WINDOW_LENGTH = 11
+SG_POLY_ORDER = 3
+SG_COEFF_FILE = 'sg_coeffs.npz'
+
+@functools.lru_cache(maxsize=1)
+def sg_derivative_coeffs():
+    """Returns the (deriv=1, deriv=2) FIR coefficient vectors as float32,
+    which keeps the convolutions in the same width as the wire data.
+
+    The vectors only depend on the constants above, so they are persisted
+    in a sidecar file alongside the (window, order, delta) they were
+    derived from; runs that find a matching sidecar skip the scipy import
+    and the coefficient solve entirely, while a stale one (written with
+    different constants) falls through to the solve."""
+    params = np.array([SG_WINDOW_LENGTH, SG_POLY_ORDER, SAMPLE_PERIOD_SEC], dtype=np.float64)
+    try:
+        cached = np.load(SG_COEFF_FILE)
+        if np.array_equal(cached['params'], params):
+            return cached['sg_d1'], cached['sg_d2']
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+
+    from scipy.signal import savgol_coeffs
+    sg_d1 = savgol_coeffs(SG_WINDOW_LENGTH, SG_POLY_ORDER, deriv=1, delta=SAMPLE_PERIOD_SEC).astype(np.float32)
+    sg_d2 = savgol_coeffs(SG_WINDOW_LENGTH, SG_POLY_ORDER, deriv=2, delta=SAMPLE_PERIOD_SEC).astype(np.float32)
+    np.savez(SG_COEFF_FILE, params=params, sg_d1=sg_d1, sg_d2=sg_d2)
+    return sg_d1, sg_d2
+
 # --- Protocol Definitions ---
 HOST_CHECK_CONNECTION   = b'\x01'
 DEVICE_CHECK_CONNECTION = b'\x02'
@@ -29,10 +70,10 @@ DEVICE_DATA_REQUEST_ACK = b'\x07'
 DEVICE_DATA_STREAM_START = b'DATA_START'
 DEVICE_DATA_STREAM_END   = b'DATA_END'
 
-def run_experiment_and_process_data(inertia_value):
+def run_experiment_and_process_data(slope, intercept, inertia_value):
     """
-    Runs experiment, downloads data, and computes derivatives 
-    to recover Real Torque.
+    Runs experiment, downloads data, and computes derivatives
+    to recover Real Torque plus the model's Predicted Torque.
     """
     print("\n--- 1. Hardware Interface ---")
     try:
@@ -47,10 +88,14 @@ def run_experiment_and_process_data(inertia_value):
         ser.reset_output_buffer()
 
         # 1. Check connection
+        # Bounded read_until skips bootloader junk inside pyserial's loop
+        # instead of polling one byte per Python call.
         print("Connecting to controller...")
         ser.write(HOST_CHECK_CONNECTION)
-        while ser.read(1) != DEVICE_CHECK_CONNECTION:
-            pass
+        resp = ser.read_until(DEVICE_CHECK_CONNECTION, size=64)
+        if not resp.endswith(DEVICE_CHECK_CONNECTION):
+            print("Error: Device did not confirm connection.")
+            return None
         print("   -> Connection confirmed.")
 
         # 2. User Start
@@ -60,7 +105,7 @@ def run_experiment_and_process_data(inertia_value):
         print("Sending start command...")
         ser.write(HOST_START_TEST)
 
-        if ser.read(1) != DEVICE_ACK_START:
+        if not ser.read_until(DEVICE_ACK_START, size=64).endswith(DEVICE_ACK_START):
             print("Error: Device did not acknowledge start.")
             return None
         print("   -> Test running...")
@@ -68,7 +113,7 @@ def run_experiment_and_process_data(inertia_value):
         # 4. Wait for completion
         print("Waiting for test completion (~41 seconds)...")
         ser.timeout = 60 
-        if ser.read(1) != DEVICE_TEST_SUCCESS:
+        if not ser.read_until(DEVICE_TEST_SUCCESS, size=64).endswith(DEVICE_TEST_SUCCESS):
             print("Error: Test failed or timed out.")
             return None
         print("   -> Test completed.")
@@ -78,52 +123,69 @@ def run_experiment_and_process_data(inertia_value):
         print("Requesting data...")
         ser.write(HOST_REQUEST_DATA)
 
-        if ser.read(1) != DEVICE_DATA_REQUEST_ACK:
+        if not ser.read_until(DEVICE_DATA_REQUEST_ACK, size=64).endswith(DEVICE_DATA_REQUEST_ACK):
             print("Error: Device did not ack data request.")
             return None
 
         # 6. Read Data
+        # The whole stream (header + both payloads + footer) accumulates
+        # into one preallocated buffer via readinto; pyserial's timeout is a
+        # per-call deadline, so a single read can't cover the ~2.85 s the
+        # transfer takes at 115200 baud. The float arrays are zero-copy
+        # '<f4' views over slices of that one buffer (the data is born
+        # float32 on the ESP32, so the whole pipeline stays in that width).
         print("Downloading data stream...")
-        if ser.read(len(DEVICE_DATA_STREAM_START)) != DEVICE_DATA_STREAM_START:
+        header_len = len(DEVICE_DATA_STREAM_START)
+        footer_len = len(DEVICE_DATA_STREAM_END)
+        bytes_to_read = TEST_DATA_LENGTH * 4
+        total_len = header_len + 2 * bytes_to_read + footer_len
+
+        blob = bytearray(total_len)
+        view = memoryview(blob)
+        received = 0
+        while received < total_len:
+            n = ser.readinto(view[received:])
+            if not n:
+                break
+            received += n
+
+        if received < total_len:
+            print(f"Error: Incomplete data stream. Got {received} of {total_len} bytes.")
+            return None
+
+        if blob[:header_len] != DEVICE_DATA_STREAM_START:
             print("Error: Invalid header.")
             return None
+        if blob[total_len - footer_len:] != DEVICE_DATA_STREAM_END:
+            print("Warning: Invalid footer.")
 
-        bytes_to_read = TEST_DATA_LENGTH * 4
-        raw_input = ser.read(bytes_to_read)
-        raw_angle = ser.read(bytes_to_read)
+        input_values = np.frombuffer(view[header_len:header_len + bytes_to_read], dtype='<f4')
+        angle_values = np.frombuffer(view[header_len + bytes_to_read:total_len - footer_len], dtype='<f4')
 
-        if ser.read(len(DEVICE_DATA_STREAM_END)) != DEVICE_DATA_STREAM_END:
-            print("Warning: Invalid footer.")
+        # All six columns live in one contiguous (N, 6) float32 block and the
+        # DataFrame is a view over it, so downstream column math walks
+        # adjacent stripes of a single allocation.
+        buf = np.empty((TEST_DATA_LENGTH, 6), dtype=np.float32)
+        buf[:, 0] = np.arange(TEST_DATA_LENGTH, dtype=np.float32) * SAMPLE_PERIOD_SEC
+        buf[:, 1] = input_values
+        buf[:, 2] = angle_values
 
-        fmt = f'<{TEST_DATA_LENGTH}f'
-        input_values = struct.unpack(fmt, raw_input)
-        angle_values = struct.unpack(fmt, raw_angle)
-        
-        # Create DataFrame
-        time_axis = [i * SAMPLE_PERIOD_SEC for i in range(TEST_DATA_LENGTH)]
-        df = pd.DataFrame({
-            'Time(s)': time_axis,
-            'Input': input_values,
-            'Real_Angle': angle_values
-        })
-        
         # --- Process Derivatives to find Real Torque ---
         print("Computing Real Torque from Angle data...")
-        dt = SAMPLE_PERIOD_SEC
-        window_length = 11 
-        poly_order = 3
-
-        # 1. Velocity
-        df['Velocity'] = savgol_filter(df['Real_Angle'], window_length, poly_order, deriv=1, delta=dt)
-        # 2. Acceleration
-        df['Acceleration'] = savgol_filter(df['Real_Angle'], window_length, poly_order, deriv=2, delta=dt)
-        # 3. Real Torque (Tau = I * alpha)
-        df['Real_Torque'] = inertia_value * df['Acceleration']
-
-        filename = 'validation_data.csv'
-        df.to_csv(filename, index=False)
-        print(f"   -> Data saved to {filename}")
-        
+        from scipy.ndimage import convolve1d
+        sg_d1, sg_d2 = sg_derivative_coeffs()
+        # 1. Velocity (convolved from the contiguous wire-payload view)
+        buf[:, 3] = convolve1d(angle_values, sg_d1, mode='nearest')
+        # 2. Real Torque (Tau = I * alpha): folding the inertia scalar into
+        # the deriv=2 kernel makes one convolution emit torque directly,
+        # without materializing an acceleration array in between.
+        buf[:, 4] = convolve1d(angle_values, inertia_value * sg_d2, mode='nearest')
+        # 3. Predicted Torque (Model: Torque = K * Input + Offset)
+        buf[:, 5] = slope * input_values + intercept
+
+        columns = ['Time(s)', 'Input', 'Real_Angle', 'Velocity', 'Real_Torque', 'Predicted_Torque']
+        df = pd.DataFrame(buf, copy=False, columns=columns)
+
         return df
 
     except Exception as e:
@@ -133,22 +195,38 @@ def run_experiment_and_process_data(inertia_value):
         if ser.is_open:
             ser.close()
 
+@functools.lru_cache(maxsize=1)
 def load_model_parameters():
-    """Loads parameters from JSON. Raises error if not found."""
-    if not os.path.exists(MODEL_FILE):
+    """Loads parameters from JSON. Exits with an error if not found.
+
+    Cached so callers embedding this in a longer pipeline re-read the
+    file only once; the open itself is EAFP (one syscall, no stat)."""
+    try:
+        f = open(MODEL_FILE, 'rb')
+    except FileNotFoundError:
         print(f"\n[ERROR] Model file '{MODEL_FILE}' not found.")
         print("Please run 'estimate.py' first to generate the model parameters.")
         sys.exit(1)
 
     try:
-        with open(MODEL_FILE, 'r') as f:
-            data = json.load(f)
-            print(f"\n[INFO] Automatically loaded model from '{MODEL_FILE}'")
-            return data['slope'], data['intercept'], data['inertia']
+        with f:
+            data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+        print(f"\n[INFO] Automatically loaded model from '{MODEL_FILE}'")
+        return data['slope'], data['intercept'], data['inertia']
     except Exception as e:
         print(f"\n[ERROR] Failed to read '{MODEL_FILE}': {e}")
         sys.exit(1)
 
+def save_validation_data(df):
+    """Writes validation_data.csv. Runs on a background thread so the disk
+    I/O overlaps with the analysis and plotting on the main thread."""
+    filename = 'validation_data.csv'
+    # np.savetxt formats the block in one C-level pass; pandas' to_csv
+    # pushes every cell through its general-purpose Python formatter.
+    np.savetxt(filename, df.to_numpy(), delimiter=',',
+               header=','.join(df.columns), fmt='%.6g', comments='')
+    print(f"   -> Data saved to {filename}")
+
 def main():
     print("=== System Validation Tool (Torque Domain) ===")
     
@@ -157,43 +235,62 @@ def main():
     print(f"Model: Torque = {slope:.4f} * Input + {intercept:.4f}")
     print(f"Inertia: {inertia:.6e}")
 
-    # 2. Run Experiment & Calculate Real Torque
-    df = run_experiment_and_process_data(inertia)
+    # 2. Run Experiment, Calculate Real & Predicted Torque
+    df = run_experiment_and_process_data(slope, intercept, inertia)
     if df is None:
         return
 
-    # 3. Calculate Predicted Torque
-    print("\n--- 2. Model Prediction ---")
-    # Model: Torque = K * Input + Offset
-    df['Predicted_Torque'] = (slope * df['Input']) + intercept
+    # 3. Save the processed table in the background while analysis and
+    # plotting run on the main thread.
+    writer = threading.Thread(target=save_validation_data, args=(df,))
+    writer.start()
 
     # 4. Analysis
-    # RMSE on Torque
-    rmse = np.sqrt(((df['Real_Torque'] - df['Predicted_Torque']) ** 2).mean())
+    print("\n--- 2. Model Prediction ---")
+    # RMSE on Torque, computed on the raw arrays to skip pandas' per-op
+    # Series allocation and index alignment. The dot product streams the
+    # residual once through BLAS instead of allocating a squared copy.
+    real_torque = df['Real_Torque'].to_numpy()
+    predicted_torque = df['Predicted_Torque'].to_numpy()
+    error = real_torque - predicted_torque
+    # The first/last half-window of torque samples come from the filter's
+    # 'nearest' edge extension, not real derivative estimates, so they are
+    # left out of the metric.
+    edge = SG_WINDOW_LENGTH // 2
+    diff = error[edge:-edge]
+    rmse = math.sqrt(diff @ diff / diff.size)
     
     print("\n--- Validation Results ---")
     print(f"Torque RMSE: {rmse:.4f} N*m")
 
     # 5. Plotting
     print("Plotting comparison...")
+    import matplotlib
+    if os.environ.get('HEADLESS'):
+        matplotlib.use('Agg')  # no GUI toolkit import in batch runs
+    import matplotlib.pyplot as plt
+    # Let the renderer drop sub-pixel segments of the 4096-point lines.
+    plt.rcParams['path.simplify'] = True
+    plt.rcParams['path.simplify_threshold'] = 1.0
+
+    t = df['Time(s)'].to_numpy()
     fig, axs = plt.subplots(3, 1, figsize=(10, 10), sharex=True)
 
     # Plot 1: Input
-    axs[0].plot(df['Time(s)'], df['Input'], color='gray', alpha=0.7)
+    axs[0].plot(t, df['Input'].to_numpy(), color='gray', alpha=0.7)
     axs[0].set_ylabel('Input Signal')
     axs[0].set_title('Validation: Real vs. Model (Torque Domain)')
     axs[0].grid(True)
 
     # Plot 2: Torque Comparison
-    axs[1].plot(df['Time(s)'], df['Real_Torque'], label='Real (derived from Angle)', color='tab:blue', linewidth=1.5, alpha=0.8)
-    axs[1].plot(df['Time(s)'], df['Predicted_Torque'], label='Model Prediction', color='tab:orange', linestyle='--', linewidth=2)
+    axs[1].plot(t, real_torque, label='Real (derived from Angle)', color='tab:blue', linewidth=1.5, alpha=0.8)
+    axs[1].plot(t, predicted_torque, label='Model Prediction', color='tab:orange', linestyle='--', linewidth=2)
     axs[1].set_ylabel('Torque (N*m)')
     axs[1].legend(loc='upper right')
     axs[1].grid(True)
 
     # Plot 3: Error Residuals
-    error = df['Real_Torque'] - df['Predicted_Torque']
-    axs[2].plot(df['Time(s)'], error, color='tab:red')
+    axs[2].plot(t, error, color='tab:red')
     axs[2].set_ylabel('Error (N*m)')
     axs[2].set_xlabel('Time (s)')
     axs[2].axhline(0, color='black', linewidth=1)
@@ -201,9 +298,13 @@ def main():
     axs[2].set_title(f'Torque Prediction Error (RMSE: {rmse:.4f})')
 
     plt.tight_layout()
-    plt.savefig('validation_results.png')
-    print("Results saved to validation_results.png. Displaying...")
-    plt.show()
+    plt.savefig('validation_results.png', dpi=100)
+    print("Results saved to validation_results.png.")
+    if not os.environ.get('HEADLESS'):
+        print("Displaying...")
+        plt.show()
+
+    writer.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file